@@ -0,0 +1,250 @@
+import csv
+import io
+
+from psycopg2.extras import RealDictCursor
+
+from .db import get_db
+
+BULK_KINDS = {
+    "tokens": ("telegram_id", "amount"),
+    "ban": ("telegram_id", "is_banned"),
+    "task": ("telegram_id", "task_id", "enabled"),
+}
+
+TRUE_VALUES = {"1", "true", "yes", "on", "y"}
+FALSE_VALUES = {"0", "false", "no", "off", "n"}
+
+STAGING_COLUMNS = ("row_no", "telegram_id", "amount", "reason", "flag", "task_id")
+
+BIGINT_MAX = 2**63 - 1
+INT_MAX = 2**31 - 1
+
+
+def parse_int(row: dict, column: str, maximum: int) -> int:
+    """Parse a column that is staged into a Postgres integer type of the given range."""
+    try:
+        value = int(row[column])
+    except ValueError:
+        raise ValueError(f"{column} must be an integer") from None
+    if not -maximum - 1 <= value <= maximum:
+        raise ValueError(f"{column} out of range")
+    return value
+
+
+def parse_bool(value: str) -> bool:
+    normalized = value.strip().lower()
+    if normalized in TRUE_VALUES:
+        return True
+    if normalized in FALSE_VALUES:
+        return False
+    raise ValueError(f"invalid boolean {value!r}")
+
+
+def parse_row(kind: str, row: dict) -> dict:
+    staged = {
+        "telegram_id": parse_int(row, "telegram_id", BIGINT_MAX),
+        "amount": None,
+        "reason": None,
+        "flag": None,
+        "task_id": None,
+    }
+    if kind == "tokens":
+        staged["amount"] = parse_int(row, "amount", BIGINT_MAX)
+        if staged["amount"] == 0:
+            raise ValueError("amount must not be zero")
+        staged["reason"] = (row.get("reason") or "").strip() or "Bulk adjustment"
+    elif kind == "ban":
+        staged["flag"] = parse_bool(row["is_banned"])
+    else:
+        staged["task_id"] = parse_int(row, "task_id", INT_MAX)
+        staged["flag"] = parse_bool(row["enabled"])
+    return staged
+
+
+def read_rows(kind: str, content: bytes):
+    """Parse the uploaded CSV, returning (valid rows, per-row errors).
+
+    Rows are numbered by the file line their record ends on, counting the header as
+    line 1, so blank lines and multi-line quoted fields do not shift the numbers.
+    """
+    required = BULK_KINDS[kind]
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return [], [{"row": 0, "telegram_id": None, "error": "File is not valid UTF-8"}]
+    reader = csv.DictReader(io.StringIO(text))
+    header = [name.strip() for name in reader.fieldnames or []]
+    missing = [name for name in required if name not in header]
+    if missing:
+        return [], [{"row": 1, "telegram_id": None, "error": f"Missing columns: {', '.join(missing)}"}]
+    reader.fieldnames = header
+    rows, errors = [], []
+    for row in reader:
+        row_no = reader.line_num
+        try:
+            staged = parse_row(kind, {key: (value or "") for key, value in row.items() if key})
+        except (TypeError, ValueError) as exc:
+            errors.append({"row": row_no, "telegram_id": row.get("telegram_id"), "error": str(exc)})
+            continue
+        staged["row_no"] = row_no
+        rows.append(staged)
+    return rows, errors
+
+
+def copy_rows(cur, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[column] is None else row[column] for column in STAGING_COLUMNS])
+    buffer.seek(0)
+    cur.execute(
+        """
+        CREATE TEMP TABLE bulk_rows (
+            row_no INT PRIMARY KEY,
+            telegram_id BIGINT NOT NULL,
+            amount BIGINT,
+            reason TEXT,
+            flag BOOLEAN,
+            task_id INT
+        ) ON COMMIT DROP
+        """
+    )
+    cur.copy_expert(f"COPY bulk_rows ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def reject_rows(cur, query: str):
+    cur.execute(
+        f"""
+        WITH rejected AS ({query})
+        DELETE FROM bulk_rows b
+        USING rejected r
+        WHERE b.row_no = r.row_no
+        RETURNING b.row_no AS row, b.telegram_id, r.error
+        """
+    )
+    return cur.fetchall()
+
+
+def apply_tokens(cur, admin_telegram_id: int) -> int:
+    cur.execute(
+        """
+        UPDATE users u
+        SET tokens = u.tokens + b.total
+        FROM (SELECT telegram_id, SUM(amount) AS total FROM bulk_rows GROUP BY telegram_id) b
+        WHERE u.telegram_id = b.telegram_id
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO token_history (user_id, change_amount, reason)
+        SELECT telegram_id, amount, reason || ' (bulk by ' || %(admin)s || ')'
+        FROM bulk_rows
+        ORDER BY row_no
+        """,
+        {"admin": str(admin_telegram_id)},
+    )
+    return cur.rowcount
+
+
+def apply_bans(cur) -> int:
+    cur.execute(
+        """
+        UPDATE users u
+        SET is_banned = b.flag
+        FROM (
+            SELECT DISTINCT ON (telegram_id) telegram_id, flag
+            FROM bulk_rows
+            ORDER BY telegram_id, row_no DESC
+        ) b
+        WHERE u.telegram_id = b.telegram_id
+        """
+    )
+    return cur.rowcount
+
+
+def apply_tasks(cur) -> int:
+    cur.execute(
+        """
+        INSERT INTO user_tasks (user_id, task_id, status, enabled)
+        SELECT DISTINCT ON (telegram_id, task_id) telegram_id, task_id, 'pending', flag
+        FROM bulk_rows
+        ORDER BY telegram_id, task_id, row_no DESC
+        ON CONFLICT (user_id, task_id)
+        DO UPDATE SET enabled = EXCLUDED.enabled
+        """
+    )
+    return cur.rowcount
+
+
+def run_bulk_import(kind: str, content: bytes, admin_telegram_id: int, dry_run: bool = True) -> dict:
+    """Stage an uploaded CSV with COPY and apply it in a single transaction.
+
+    Every row either lands in the report's ``errors`` list or is applied; in dry-run
+    mode the transaction is rolled back after validation so nothing is persisted.
+    """
+    if kind not in BULK_KINDS:
+        raise ValueError(f"Unsupported bulk kind: {kind}")
+    rows, errors = read_rows(kind, content)
+    report = {"kind": kind, "dry_run": dry_run, "total": len(rows) + len(errors), "applied": 0, "changed": 0}
+    if rows:
+        with get_db() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    copy_rows(cur, rows)
+                    errors.extend(
+                        reject_rows(
+                            cur,
+                            """
+                            SELECT b.row_no, 'Unknown user' AS error
+                            FROM bulk_rows b
+                            WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.telegram_id = b.telegram_id)
+                            """,
+                        )
+                    )
+                    if kind == "tokens":
+                        errors.extend(
+                            reject_rows(
+                                cur,
+                                """
+                                SELECT
+                                    b.row_no,
+                                    CASE WHEN u.tokens + t.total < 0
+                                        THEN 'Balance would become negative'
+                                        ELSE 'Balance would exceed the maximum'
+                                    END AS error
+                                FROM bulk_rows b
+                                JOIN users u ON u.telegram_id = b.telegram_id
+                                JOIN (
+                                    SELECT telegram_id, SUM(amount) AS total FROM bulk_rows GROUP BY telegram_id
+                                ) t ON t.telegram_id = b.telegram_id
+                                WHERE u.tokens + t.total < 0 OR u.tokens + t.total > 9223372036854775807
+                                """,
+                            )
+                        )
+                        changed = apply_tokens(cur, admin_telegram_id)
+                    elif kind == "ban":
+                        changed = apply_bans(cur)
+                    else:
+                        errors.extend(
+                            reject_rows(
+                                cur,
+                                """
+                                SELECT b.row_no, 'Unknown task' AS error
+                                FROM bulk_rows b
+                                WHERE NOT EXISTS (SELECT 1 FROM tasks t WHERE t.id = b.task_id)
+                                """,
+                            )
+                        )
+                        changed = apply_tasks(cur)
+                    cur.execute("SELECT COUNT(*) AS count FROM bulk_rows")
+                    report["applied"] = cur.fetchone()["count"]
+                    report["changed"] = changed
+                if dry_run:
+                    conn.rollback()
+                else:
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    report["errors"] = sorted(errors, key=lambda error: error["row"])
+    return report
@@ -0,0 +1,80 @@
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+from .db import DATABASE_URL, execute
+
+# Safety net for a missed notification; invalidation normally arrives within milliseconds.
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_CHANNEL = "cache_invalidation"
+
+logger = logging.getLogger(__name__)
+
+# name -> (loaded_at, value)
+_entries = {}
+# Bumped on every drop so a load that raced with an invalidation is not stored.
+_generation = 0
+
+
+def drop(name=None):
+    global _generation
+    _generation += 1
+    if name is None:
+        _entries.clear()
+    else:
+        _entries.pop(name, None)
+
+
+def cached(name: str, loader):
+    entry = _entries.get(name)
+    now = time.monotonic()
+    if entry and now - entry[0] < CACHE_TTL_SECONDS:
+        return entry[1]
+    generation = _generation
+    value = loader()
+    if generation == _generation:
+        _entries[name] = (now, value)
+    return value
+
+
+def invalidate(name: str):
+    """Drop ``name`` here and tell every other worker to drop it too."""
+    drop(name)
+    execute("SELECT pg_notify(%(channel)s, %(name)s)", {"channel": CACHE_CHANNEL, "name": name})
+
+
+def listen_for_invalidations():
+    while True:
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+        except psycopg2.Error:
+            logger.exception("Cache invalidation listener could not connect")
+            time.sleep(5)
+            continue
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CACHE_CHANNEL}")
+            # Anything may have changed while we were not listening.
+            drop()
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    drop(conn.notifies.pop(0).payload)
+        except psycopg2.Error:
+            logger.exception("Cache invalidation listener lost its connection")
+            time.sleep(1)
+        finally:
+            conn.close()
+
+
+def start_invalidation_listener():
+    thread = threading.Thread(target=listen_for_invalidations, name="cache-invalidation", daemon=True)
+    thread.start()
+    return thread
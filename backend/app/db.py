@@ -1,37 +1,241 @@
+import math
 import os
+import random
+import threading
+import time
 from contextlib import contextmanager
+from contextvars import ContextVar
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+# libpq rounds anything below 2 up to 2 seconds.
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+# How long a client that wrote keeps reading from the primary: a replica that passed
+# its last probe may be up to the lag threshold behind, plus one probe interval.
+READ_YOUR_WRITES_SECONDS = math.ceil(REPLICA_MAX_LAG_SECONDS + REPLICA_LAG_CHECK_SECONDS)
+
+# DB_MAX_CONNECTIONS is the budget for the whole backend, split evenly across workers.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "40"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or max(2, DB_MAX_CONNECTIONS // WEB_CONCURRENCY))
+# How long a caller waits for a free connection before giving up.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# dsn -> pool, owned by the process in _pools_pid; a forked worker starts its own.
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+# {"primary": bool, "wrote": bool} for the current request. Mutated in place rather
+# than re-set, so the middleware that installed it sees writes made by the endpoint.
+_read_routing = ContextVar("read_routing", default=None)
+
+# dsn -> usable, written only by the replica monitor thread of this process.
+# bot/db.py mirrors the probe and fallback rules; keep the two in sync.
+_replica_health = {}
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+# NULL means unusable: a standby without a streaming WAL receiver has replayed all it
+# received but may be arbitrarily far behind. Roles without pg_read_all_stats see
+# status as NULL, so only an existing receiver is required for them.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE pid IS NOT NULL AND COALESCE(status, 'streaming') = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ConnectionPool:
+    """At most ``size`` connections to one DSN; callers wait for a free slot."""
+
+    def __init__(self, dsn: str, size: int, **options):
+        self.dsn = dsn
+        self.options = options
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise PoolError("connection pool exhausted")
+        try:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+            return conn or psycopg2.connect(self.dsn, **self.options)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        try:
+            if close or conn.closed:
+                conn.close()
+            else:
+                with self.lock:
+                    self.idle.append(conn)
+        finally:
+            self.slots.release()
+
+    def discard_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+def get_pool(dsn: str) -> ConnectionPool:
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections inherited across fork belong to the parent; never reuse them.
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(dsn)
+        if pool is None:
+            options = {} if dsn == DATABASE_URL else {"connect_timeout": REPLICA_CONNECT_TIMEOUT}
+            pool = _pools[dsn] = ConnectionPool(dsn, DB_POOL_SIZE, **options)
+        return pool
 
 
 @contextmanager
-def get_db():
-    conn = psycopg2.connect(DATABASE_URL)
+def get_db(dsn=None):
+    pool = get_pool(dsn or DATABASE_URL)
+    conn = pool.getconn()
     try:
         yield conn
+    finally:
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        pool.putconn(conn, close=broken)
+
+
+def reset_read_routing(primary: bool = False) -> dict:
+    """Start routing a new request; ``primary`` sends all of its reads to the primary."""
+    routing = {"primary": primary, "wrote": False}
+    _read_routing.set(routing)
+    return routing
+
+
+def stick_to_primary():
+    routing = _read_routing.get() or reset_read_routing()
+    routing["primary"] = routing["wrote"] = True
+
+
+def probe_replica(dsn: str) -> bool:
+    try:
+        conn = psycopg2.connect(dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+    except psycopg2.Error:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(REPLICA_LAG_QUERY)
+            lag = cur.fetchone()[0]
+        return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+    except psycopg2.Error:
+        return False
     finally:
         conn.close()
 
 
-def fetch_one(query, params=None):
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params or {})
-            return cur.fetchone()
+def monitor_replicas():
+    while True:
+        for dsn in DATABASE_REPLICA_URLS:
+            _replica_health[dsn] = probe_replica(dsn)
+        time.sleep(REPLICA_LAG_CHECK_SECONDS)
+
+
+def ensure_replica_monitor():
+    """Start the probe thread once per process, so reads never wait on a probe."""
+    global _monitor_pid
+    if _monitor_pid == os.getpid():
+        return
+    with _monitor_lock:
+        if _monitor_pid != os.getpid():
+            _replica_health.clear()
+            threading.Thread(target=monitor_replicas, name="replica-monitor", daemon=True).start()
+            _monitor_pid = os.getpid()
+
+
+def mark_replica_unusable(dsn: str):
+    _replica_health[dsn] = False
+
+
+def read_dsn() -> str:
+    """Pick the DSN for a read: a healthy replica, or the primary when none qualifies."""
+    routing = _read_routing.get()
+    if (routing and routing["primary"]) or not DATABASE_REPLICA_URLS:
+        return DATABASE_URL
+    ensure_replica_monitor()
+    replicas = [dsn for dsn in DATABASE_REPLICA_URLS if _replica_health.get(dsn, False)]
+    return random.choice(replicas) if replicas else DATABASE_URL
 
 
-def fetch_all(query, params=None):
-    with get_db() as conn:
+def _run(dsn, work, commit=False):
+    """Run work(conn), retrying once on a fresh connection if the pooled one was dead.
+
+    Only the work is retried: an uncommitted transaction on a lost connection never
+    took effect, whereas a commit that failed midway might have.
+    """
+    for attempt in range(2):
+        with get_db(dsn) as conn:
+            try:
+                result = work(conn)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt or not conn.closed:
+                    raise
+            else:
+                if commit:
+                    conn.commit()
+                return result
+        # The server dropped this connection (restart, failover); the idle ones are gone too.
+        get_pool(dsn).discard_idle()
+
+
+def _fetch(query, params, fetch, primary):
+    def work(conn):
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(query, params or {})
-            return cur.fetchall()
+            return fetch(cur)
+
+    dsn = DATABASE_URL if primary else read_dsn()
+    if dsn != DATABASE_URL:
+        try:
+            return _run(dsn, work)
+        except psycopg2.OperationalError:
+            mark_replica_unusable(dsn)
+    return _run(DATABASE_URL, work)
+
+
+def fetch_one(query, params=None, primary=False):
+    return _fetch(query, params, lambda cur: cur.fetchone(), primary)
+
+
+def fetch_all(query, params=None, primary=False):
+    return _fetch(query, params, lambda cur: cur.fetchall(), primary)
 
 
 def execute(query, params=None):
-    with get_db() as conn:
+    stick_to_primary()
+
+    def work(conn):
         with conn.cursor() as cur:
             cur.execute(query, params or {})
-        conn.commit()
+
+    _run(DATABASE_URL, work, commit=True)
@@ -1,12 +1,34 @@
+import asyncio
+import logging
 import os
 from typing import Optional
 
 import requests
-from fastapi import FastAPI, Form, HTTPException, Request
+from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
-from .db import execute, fetch_all, fetch_one
+from .bulk import BULK_KINDS, run_bulk_import
+from .cache import cached, invalidate, start_invalidation_listener
+from .db import (
+    DATABASE_REPLICA_URLS,
+    READ_YOUR_WRITES_SECONDS,
+    WEB_CONCURRENCY,
+    execute,
+    fetch_all,
+    fetch_one,
+    reset_read_routing,
+)
+from .ratelimit import enforce_rate_limit, rejection_counts
+from .referrals import (
+    REFERRAL_LEADERBOARD_REFRESH_SECONDS,
+    ensure_referral_schema,
+    get_leaderboard,
+    get_public_leaderboard,
+    get_referral_stats,
+    pay_deposit_referral_bonus,
+    refresh_leaderboard,
+)
 
 app = FastAPI()
 
@@ -16,6 +38,10 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_USERNAME = os.getenv("BOT_USERNAME")
 ADMIN_TELEGRAM_ID = int(os.getenv("ADMIN_TELEGRAM_ID", "0"))
 
+READ_PRIMARY_COOKIE = "read_primary"
+
+logger = logging.getLogger(__name__)
+
 
 def ensure_user(telegram_id: int, username: Optional[str] = None):
     user = fetch_one("SELECT * FROM users WHERE telegram_id = %(telegram_id)s", {"telegram_id": telegram_id})
@@ -24,6 +50,7 @@ def ensure_user(telegram_id: int, username: Optional[str] = None):
             """
             INSERT INTO users (telegram_id, username)
             VALUES (%(telegram_id)s, %(username)s)
+            ON CONFLICT (telegram_id) DO NOTHING
             """,
             {"telegram_id": telegram_id, "username": username},
         )
@@ -31,13 +58,30 @@ def ensure_user(telegram_id: int, username: Optional[str] = None):
     return user
 
 
+# Cached lookups load from the primary: a lagging replica could re-cache data that
+# was just invalidated.
 def get_setting(key: str, default: str) -> str:
-    setting = fetch_one("SELECT value FROM settings WHERE key = %(key)s", {"key": key})
-    return setting["value"] if setting else default
+    settings = cached(
+        "settings",
+        lambda: {row["key"]: row["value"] for row in fetch_all("SELECT key, value FROM settings", primary=True)},
+    )
+    return settings.get(key, default)
 
 
 def get_mandatory_channels():
-    return fetch_all("SELECT * FROM mandatory_channels ORDER BY id")
+    return cached("channels", lambda: fetch_all("SELECT * FROM mandatory_channels ORDER BY id", primary=True))
+
+
+def get_tasks():
+    return cached("tasks", lambda: fetch_all("SELECT * FROM tasks ORDER BY id", primary=True))
+
+
+def get_task(task_id: int):
+    return next((task for task in get_tasks() if task["id"] == task_id), None)
+
+
+def get_news():
+    return cached("news", lambda: fetch_all("SELECT * FROM news ORDER BY created_at DESC", primary=True))
 
 
 def check_subscription(telegram_id: int):
@@ -60,46 +104,94 @@ def check_subscription(telegram_id: int):
     return missing
 
 
+async def refresh_referral_leaderboard_periodically():
+    schema_ready = False
+    while True:
+        try:
+            if not schema_ready:
+                if await asyncio.to_thread(ensure_referral_schema):
+                    logger.info("Applied referral schema migration")
+                schema_ready = True
+            await asyncio.to_thread(refresh_leaderboard)
+        except Exception:
+            logger.exception("Referral leaderboard refresh failed")
+        await asyncio.sleep(REFERRAL_LEADERBOARD_REFRESH_SECONDS)
+
+
+@app.middleware("http")
+async def route_reads_per_request(request: Request, call_next):
+    # A client that wrote keeps reading from the primary until the replicas have caught
+    # up, whichever worker its next request lands on.
+    routing = reset_read_routing(primary=READ_PRIMARY_COOKIE in request.cookies)
+    response = await call_next(request)
+    if routing["wrote"] and DATABASE_REPLICA_URLS:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE, "1", max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite="lax"
+        )
+    return response
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    start_invalidation_listener()
+    app.state.leaderboard_task = asyncio.create_task(refresh_referral_leaderboard_periodically())
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
 
 @app.post("/api/validate-subscription")
-async def validate_subscription(payload: dict):
+async def validate_subscription(payload: dict, request: Request):
     telegram_id = int(payload.get("telegram_id", 0))
     if not telegram_id:
         raise HTTPException(status_code=400, detail="telegram_id is required")
+    enforce_rate_limit("validate_subscription", request, telegram_id)
     ensure_user(telegram_id, payload.get("username"))
-    missing = check_subscription(telegram_id)
+    missing = await asyncio.to_thread(check_subscription, telegram_id)
     return {"missing": missing}
 
 
 @app.get("/api/tasks")
 async def list_tasks(telegram_id: int):
     ensure_user(telegram_id)
-    tasks = fetch_all(
-        """
-        SELECT t.*, ut.status, ut.enabled, ut.completed_at
-        FROM tasks t
-        LEFT JOIN user_tasks ut ON ut.task_id = t.id AND ut.user_id = %(telegram_id)s
-        WHERE t.is_active = TRUE
-          AND (ut.enabled IS NULL OR ut.enabled = TRUE)
-        ORDER BY t.id
-        """,
-        {"telegram_id": telegram_id},
-    )
+    user_tasks = {
+        row["task_id"]: row
+        for row in fetch_all(
+            "SELECT task_id, status, enabled, completed_at FROM user_tasks WHERE user_id = %(telegram_id)s",
+            {"telegram_id": telegram_id},
+        )
+    }
+    tasks = []
+    for task in get_tasks():
+        user_task = user_tasks.get(task["id"], {})
+        if not task["is_active"] or user_task.get("enabled") is False:
+            continue
+        tasks.append(
+            {
+                **task,
+                "status": user_task.get("status"),
+                "enabled": user_task.get("enabled"),
+                "completed_at": user_task.get("completed_at"),
+            }
+        )
     return {"tasks": tasks}
 
 
 @app.post("/api/tasks/complete")
-async def complete_task(payload: dict):
+async def complete_task(payload: dict, request: Request):
     telegram_id = int(payload.get("telegram_id", 0))
     task_id = int(payload.get("task_id", 0))
     if not telegram_id or not task_id:
         raise HTTPException(status_code=400, detail="telegram_id and task_id required")
+    enforce_rate_limit("complete_task", request, telegram_id)
+    return award_task(telegram_id, task_id)
+
+
+def award_task(telegram_id: int, task_id: int):
     ensure_user(telegram_id)
-    task = fetch_one("SELECT * FROM tasks WHERE id = %(task_id)s", {"task_id": task_id})
+    task = get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     execute(
@@ -126,33 +218,24 @@ async def complete_task(payload: dict):
     )
     user = fetch_one("SELECT referred_by FROM users WHERE telegram_id = %(telegram_id)s", {"telegram_id": telegram_id})
     if user and user["referred_by"] and task["task_type"] == "deposit" and task["rarity"] == "Limited":
-        execute(
-            """
-            UPDATE users SET tokens = tokens + 5000 WHERE telegram_id = %(referrer)s
-            """,
-            {"referrer": user["referred_by"]},
-        )
-        execute(
-            """
-            INSERT INTO token_history (user_id, change_amount, reason)
-            VALUES (%(referrer)s, 5000, %(reason)s)
-            """,
-            {"referrer": user["referred_by"], "reason": f"Referral bonus for task {task_id}"},
-        )
+        pay_deposit_referral_bonus(user["referred_by"], telegram_id, task_id)
     return {"status": "ok"}
 
 
 @app.post("/api/postback")
-async def postback(payload: dict):
+async def postback(payload: dict, request: Request):
     telegram_id = int(payload.get("telegram_id", 0))
     task_id = int(payload.get("task_id", 0))
     event = payload.get("event", "")
+    if not telegram_id or not task_id:
+        raise HTTPException(status_code=400, detail="telegram_id and task_id required")
     if event not in {"registration", "deposit"}:
         raise HTTPException(status_code=400, detail="Unsupported event")
-    task = fetch_one("SELECT task_type FROM tasks WHERE id = %(task_id)s", {"task_id": task_id})
+    enforce_rate_limit("postback", request, telegram_id)
+    task = get_task(task_id)
     if not task or task["task_type"] != event:
         raise HTTPException(status_code=400, detail="Task type mismatch")
-    return await complete_task({"telegram_id": telegram_id, "task_id": task_id})
+    return award_task(telegram_id, task_id)
 
 
 @app.get("/api/profile")
@@ -168,13 +251,18 @@ async def profile(telegram_id: int):
         "referral_link": referral_link,
         "token_rate": token_rate,
         "support_link": support_link,
+        "referrals": get_referral_stats(telegram_id),
     }
 
 
+@app.get("/api/referrals/leaderboard")
+async def referral_leaderboard(limit: int = 10):
+    return {"leaderboard": get_public_leaderboard(limit)}
+
+
 @app.get("/api/news")
 async def list_news():
-    news_items = fetch_all("SELECT * FROM news ORDER BY created_at DESC")
-    return {"news": news_items}
+    return {"news": get_news()}
 
 
 def require_admin(telegram_id: int):
@@ -192,9 +280,18 @@ async def admin_home(request: Request, telegram_id: int):
         "token_circulation": fetch_one("SELECT COALESCE(SUM(tokens),0) AS sum FROM users")["sum"],
         "referrals": fetch_one("SELECT COUNT(*) AS count FROM users WHERE referred_by IS NOT NULL")["count"],
     }
+    leaderboard = get_leaderboard(10)
     return templates.TemplateResponse(
         "admin_home.html",
-        {"request": request, "stats": stats, "telegram_id": telegram_id},
+        {
+            "request": request,
+            "stats": stats,
+            "leaderboard": leaderboard,
+            "rate_limit_rejections": rejection_counts(),
+            "worker_pid": os.getpid(),
+            "worker_count": WEB_CONCURRENCY,
+            "telegram_id": telegram_id,
+        },
     )
 
 
@@ -231,6 +328,7 @@ async def admin_tasks_create(
             "reward_tokens": reward_tokens,
         },
     )
+    invalidate("tasks")
     return RedirectResponse(url=f"/admin/tasks?telegram_id={telegram_id}", status_code=303)
 
 
@@ -243,6 +341,7 @@ async def admin_tasks_toggle(task_id: int, telegram_id: int = Form(...)):
         """,
         {"task_id": task_id},
     )
+    invalidate("tasks")
     return RedirectResponse(url=f"/admin/tasks?telegram_id={telegram_id}", status_code=303)
 
 
@@ -276,6 +375,7 @@ async def admin_tasks_update(
             "task_id": task_id,
         },
     )
+    invalidate("tasks")
     return RedirectResponse(url=f"/admin/tasks?telegram_id={telegram_id}", status_code=303)
 
 
@@ -283,6 +383,7 @@ async def admin_tasks_update(
 async def admin_tasks_delete(task_id: int, telegram_id: int = Form(...)):
     require_admin(telegram_id)
     execute("DELETE FROM tasks WHERE id = %(task_id)s", {"task_id": task_id})
+    invalidate("tasks")
     return RedirectResponse(url=f"/admin/tasks?telegram_id={telegram_id}", status_code=303)
 
 
@@ -315,6 +416,7 @@ async def admin_channels_add(
             "channel_username": channel_username,
         },
     )
+    invalidate("channels")
     return RedirectResponse(url=f"/admin/channels?telegram_id={telegram_id}", status_code=303)
 
 
@@ -334,6 +436,7 @@ async def admin_channels_update(
         """,
         {"channel_title": channel_title, "channel_username": channel_username, "channel_id": channel_id},
     )
+    invalidate("channels")
     return RedirectResponse(url=f"/admin/channels?telegram_id={telegram_id}", status_code=303)
 
 
@@ -341,6 +444,7 @@ async def admin_channels_update(
 async def admin_channels_delete(channel_id: int, telegram_id: int = Form(...)):
     require_admin(telegram_id)
     execute("DELETE FROM mandatory_channels WHERE id = %(channel_id)s", {"channel_id": channel_id})
+    invalidate("channels")
     return RedirectResponse(url=f"/admin/channels?telegram_id={telegram_id}", status_code=303)
 
 
@@ -379,6 +483,7 @@ async def admin_news_add(
             "button_url": button_url,
         },
     )
+    invalidate("news")
     return RedirectResponse(url=f"/admin/news?telegram_id={telegram_id}", status_code=303)
 
 
@@ -415,6 +520,7 @@ async def admin_news_update(
             "news_id": news_id,
         },
     )
+    invalidate("news")
     return RedirectResponse(url=f"/admin/news?telegram_id={telegram_id}", status_code=303)
 
 
@@ -422,6 +528,7 @@ async def admin_news_update(
 async def admin_news_delete(news_id: int, telegram_id: int = Form(...)):
     require_admin(telegram_id)
     execute("DELETE FROM news WHERE id = %(news_id)s", {"news_id": news_id})
+    invalidate("news")
     return RedirectResponse(url=f"/admin/news?telegram_id={telegram_id}", status_code=303)
 
 
@@ -457,6 +564,7 @@ async def admin_settings_update(
         """,
         {"support_link": support_link},
     )
+    invalidate("settings")
     return RedirectResponse(url=f"/admin/settings?telegram_id={telegram_id}", status_code=303)
 
 
@@ -480,6 +588,35 @@ async def admin_users(request: Request, telegram_id: int, query: str = ""):
     )
 
 
+@app.get("/admin/users/bulk", response_class=HTMLResponse)
+async def admin_users_bulk(request: Request, telegram_id: int):
+    require_admin(telegram_id)
+    return templates.TemplateResponse(
+        "admin_users_bulk.html",
+        {"request": request, "telegram_id": telegram_id, "kinds": BULK_KINDS, "report": None},
+    )
+
+
+@app.post("/admin/users/bulk", response_class=HTMLResponse)
+async def admin_users_bulk_import(
+    request: Request,
+    telegram_id: int = Form(...),
+    kind: str = Form(...),
+    dry_run: Optional[str] = Form(None),
+    file: UploadFile = File(...),
+):
+    require_admin(telegram_id)
+    if kind not in BULK_KINDS:
+        raise HTTPException(status_code=400, detail="Unsupported bulk kind")
+    content = await file.read()
+    # Decoding, COPY and the set-based apply can take a while on large files.
+    report = await asyncio.to_thread(run_bulk_import, kind, content, telegram_id, dry_run == "on")
+    return templates.TemplateResponse(
+        "admin_users_bulk.html",
+        {"request": request, "telegram_id": telegram_id, "kinds": BULK_KINDS, "report": report},
+    )
+
+
 @app.post("/admin/users/{telegram_id}")
 async def admin_user_update(
     telegram_id: int,
@@ -526,16 +663,7 @@ async def admin_broadcasts(request: Request, telegram_id: int):
     )
 
 
-@app.post("/admin/broadcasts")
-async def admin_broadcasts_send(
-    telegram_id: int = Form(...),
-    message: str = Form(...),
-    media_type: str = Form(""),
-    media_url: str = Form(""),
-    button_text: str = Form(""),
-    button_url: str = Form(""),
-):
-    require_admin(telegram_id)
+def send_broadcast(message: str, media_type: str, media_url: str, button_text: str, button_url: str):
     users = fetch_all("SELECT telegram_id FROM users WHERE is_banned = FALSE")
     reply_markup = None
     if button_url:
@@ -573,6 +701,22 @@ async def admin_broadcasts_send(
                 },
                 timeout=10,
             )
+
+
+@app.post("/admin/broadcasts")
+async def admin_broadcasts_send(
+    background_tasks: BackgroundTasks,
+    telegram_id: int = Form(...),
+    message: str = Form(...),
+    media_type: str = Form(""),
+    media_url: str = Form(""),
+    button_text: str = Form(""),
+    button_url: str = Form(""),
+):
+    require_admin(telegram_id)
+    # Sync background tasks run in the threadpool, so a long send loop neither
+    # blocks this worker's event loop nor holds the request open.
+    background_tasks.add_task(send_broadcast, message, media_type, media_url, button_text, button_url)
     return RedirectResponse(url=f"/admin/broadcasts?telegram_id={telegram_id}", status_code=303)
 
 
@@ -0,0 +1,73 @@
+-- Referral statistics for databases created before referral_stats existed.
+-- Applied by the backend at startup (see referrals.ensure_referral_schema) when
+-- referral_stats is missing, or by hand:
+--   psql "$DATABASE_URL" -f backend/app/migrations/referrals.sql
+-- Every statement is idempotent. The table and view definitions match init.sql.
+
+CREATE TABLE IF NOT EXISTS referral_stats (
+    referrer_id BIGINT PRIMARY KEY,
+    referrals_count BIGINT NOT NULL DEFAULT 0,
+    qualified_referrals BIGINT NOT NULL DEFAULT 0,
+    tokens_earned BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS referral_qualifications (
+    referrer_id BIGINT NOT NULL,
+    referred_id BIGINT NOT NULL,
+    qualified_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (referrer_id, referred_id)
+);
+
+INSERT INTO referral_qualifications (referrer_id, referred_id)
+SELECT DISTINCT u.referred_by, u.telegram_id
+FROM users u
+JOIN user_tasks ut ON ut.user_id = u.telegram_id AND ut.status = 'completed'
+JOIN tasks t ON t.id = ut.task_id AND t.task_type = 'deposit' AND t.rarity = 'Limited'
+WHERE u.referred_by IS NOT NULL
+ON CONFLICT (referrer_id, referred_id) DO NOTHING;
+
+INSERT INTO referral_stats (referrer_id, referrals_count, qualified_referrals, tokens_earned)
+SELECT
+    r.referrer_id,
+    COALESCE(c.referrals_count, 0),
+    COALESCE(q.qualified_referrals, 0),
+    COALESCE(b.tokens_earned, 0)
+FROM (
+    SELECT referred_by AS referrer_id FROM users WHERE referred_by IS NOT NULL
+    UNION
+    SELECT user_id FROM token_history WHERE reason LIKE 'Referral bonus for %'
+) r
+LEFT JOIN (
+    SELECT referred_by AS referrer_id, COUNT(*) AS referrals_count
+    FROM users
+    WHERE referred_by IS NOT NULL
+    GROUP BY referred_by
+) c ON c.referrer_id = r.referrer_id
+LEFT JOIN (
+    SELECT user_id AS referrer_id, SUM(change_amount) AS tokens_earned
+    FROM token_history
+    WHERE reason LIKE 'Referral bonus for %'
+    GROUP BY user_id
+) b ON b.referrer_id = r.referrer_id
+LEFT JOIN (
+    SELECT referrer_id, COUNT(DISTINCT referred_id) AS qualified_referrals
+    FROM referral_qualifications
+    GROUP BY referrer_id
+) q ON q.referrer_id = r.referrer_id
+ON CONFLICT (referrer_id) DO NOTHING;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS referral_leaderboard AS
+SELECT
+    rs.referrer_id,
+    u.username,
+    rs.referrals_count,
+    rs.qualified_referrals,
+    rs.tokens_earned,
+    RANK() OVER (ORDER BY rs.tokens_earned DESC, rs.referrals_count DESC) AS rank
+FROM referral_stats rs
+LEFT JOIN users u ON u.telegram_id = rs.referrer_id
+WHERE rs.referrals_count > 0 OR rs.tokens_earned > 0;
+
+CREATE UNIQUE INDEX IF NOT EXISTS referral_leaderboard_referrer_idx ON referral_leaderboard (referrer_id);
+CREATE INDEX IF NOT EXISTS referral_leaderboard_rank_idx ON referral_leaderboard (rank);
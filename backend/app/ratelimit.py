@@ -0,0 +1,119 @@
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from fastapi import HTTPException, Request
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") not in {"0", "false", "no"}
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# Set by nginx in front of the backend. It is only honoured when the peer is one of
+# RATE_LIMIT_TRUSTED_PROXIES (IPs or CIDRs); anyone else is keyed by the peer address.
+RATE_LIMIT_IP_HEADER = os.getenv("RATE_LIMIT_IP_HEADER", "X-Real-IP")
+RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(proxy.strip(), strict=False)
+    for proxy in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",")
+    if proxy.strip()
+]
+
+# "<requests>/<seconds>" per route and key scope, overridable as RATE_LIMIT_<ROUTE>_<SCOPE>.
+DEFAULT_LIMITS = {
+    "validate_subscription": {"user": "5/60", "ip": "60/60"},
+    "complete_task": {"user": "10/60", "ip": "120/60"},
+    "postback": {"user": "30/60", "ip": "600/60"},
+}
+
+
+def parse_limit(value: str):
+    """Turn "10/60" into (capacity, refill per second)."""
+    requests_allowed, seconds = value.split("/")
+    capacity = float(requests_allowed)
+    return capacity, capacity / float(seconds)
+
+
+def load_limits():
+    limits = {}
+    for route, scopes in DEFAULT_LIMITS.items():
+        limits[route] = {
+            scope: parse_limit(os.getenv(f"RATE_LIMIT_{route.upper()}_{scope.upper()}", default))
+            for scope, default in scopes.items()
+        }
+    return limits
+
+
+class TokenBucketStore:
+    """Token buckets kept in LRU order; the least recently used bucket is evicted at capacity.
+
+    An evicted key simply starts again with a full bucket, so eviction can only make
+    the limiter more permissive, never reject a client it should have allowed.
+    """
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _refill(self, key, capacity, rate, now):
+        tokens, updated_at = self.buckets.get(key, (capacity, now))
+        return min(capacity, tokens + (now - updated_at) * rate)
+
+    def take(self, requests):
+        """Consume one token from every (key, capacity, rate) bucket, or from none.
+
+        Returns the keys of the empty buckets (empty when allowed) and the seconds
+        until all of them hold a token again.
+        """
+        now = time.monotonic()
+        with self.lock:
+            levels = [self._refill(key, capacity, rate, now) for key, capacity, rate in requests]
+            empty = [(key, (1 - tokens) / rate) for tokens, (key, _, rate) in zip(levels, requests) if tokens < 1]
+            for tokens, (key, _, _) in zip(levels, requests):
+                self.buckets[key] = (tokens if empty else tokens - 1, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return [key for key, _ in empty], max((wait for _, wait in empty), default=0)
+
+
+limits = load_limits()
+store = TokenBucketStore(RATE_LIMIT_MAX_BUCKETS)
+rejections = Counter()
+
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get(RATE_LIMIT_IP_HEADER)
+    if forwarded and is_trusted_proxy(peer):
+        return forwarded.split(",")[0].strip()
+    return peer
+
+
+def enforce_rate_limit(route: str, request: Request, telegram_id: int):
+    if not RATE_LIMIT_ENABLED:
+        return
+    keys = {"user": telegram_id, "ip": client_ip(request)}
+    buckets = [((route, scope, keys[scope]), capacity, rate) for scope, (capacity, rate) in limits[route].items()]
+    empty, wait = store.take(buckets)
+    if not empty:
+        return
+    for _, scope, _ in empty:
+        rejections[(route, scope)] += 1
+    raise HTTPException(
+        status_code=429,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(wait)))},
+    )
+
+
+def rejection_counts():
+    return {f"{route}:{scope}": count for (route, scope), count in sorted(rejections.items())}
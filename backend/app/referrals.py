@@ -0,0 +1,134 @@
+import os
+
+from .db import execute, fetch_all, fetch_one, get_db
+
+REFERRAL_LEADERBOARD_REFRESH_SECONDS = int(os.getenv("REFERRAL_LEADERBOARD_REFRESH_SECONDS", "300"))
+REFERRAL_LEADERBOARD_MAX_LIMIT = 100
+DEPOSIT_REFERRAL_BONUS = 5000
+
+# Arbitrary keys shared by every backend process so only one of each runs at a time.
+LEADERBOARD_REFRESH_LOCK = 727001
+REFERRAL_SCHEMA_LOCK = 727002
+
+REFERRAL_MIGRATION = os.path.join(os.path.dirname(__file__), "migrations", "referrals.sql")
+
+
+def ensure_referral_schema() -> bool:
+    """Create and backfill the referral tables on databases that predate them.
+
+    init.sql only runs on an empty volume, so existing deployments get the schema
+    here. Returns True when the migration was applied.
+    """
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%(key)s)", {"key": REFERRAL_SCHEMA_LOCK})
+            cur.execute(
+                """
+                SELECT to_regclass('referral_stats') IS NULL
+                    OR to_regclass('referral_qualifications') IS NULL
+                    OR to_regclass('referral_leaderboard') IS NULL
+                """
+            )
+            if not cur.fetchone()[0]:
+                return False
+            with open(REFERRAL_MIGRATION) as migration:
+                cur.execute(migration.read())
+        conn.commit()
+    return True
+
+
+def pay_deposit_referral_bonus(referrer_id: int, referred_id: int, task_id: int):
+    """Credit the referrer, write the ledger row and update the counters atomically.
+
+    The bonus is paid on every qualifying task completion, but a referred user
+    counts towards ``qualified_referrals`` only the first time.
+    """
+    execute(
+        """
+        WITH bonus AS (
+            UPDATE users SET tokens = tokens + %(amount)s WHERE telegram_id = %(referrer)s
+        ),
+        ledger AS (
+            INSERT INTO token_history (user_id, change_amount, reason)
+            VALUES (%(referrer)s, %(amount)s, %(reason)s)
+        ),
+        qualified AS (
+            INSERT INTO referral_qualifications (referrer_id, referred_id)
+            VALUES (%(referrer)s, %(referred)s)
+            ON CONFLICT (referrer_id, referred_id) DO NOTHING
+            RETURNING 1
+        )
+        INSERT INTO referral_stats (referrer_id, qualified_referrals, tokens_earned, updated_at)
+        VALUES (%(referrer)s, (SELECT COUNT(*) FROM qualified), %(amount)s, NOW())
+        ON CONFLICT (referrer_id)
+        DO UPDATE SET qualified_referrals = referral_stats.qualified_referrals + EXCLUDED.qualified_referrals,
+                      tokens_earned = referral_stats.tokens_earned + EXCLUDED.tokens_earned,
+                      updated_at = NOW()
+        """,
+        {
+            "referrer": referrer_id,
+            "referred": referred_id,
+            "amount": DEPOSIT_REFERRAL_BONUS,
+            "reason": f"Referral bonus for task {task_id}",
+        },
+    )
+
+
+def get_referral_stats(telegram_id: int) -> dict:
+    stats = fetch_one(
+        """
+        SELECT rs.referrals_count, rs.qualified_referrals, rs.tokens_earned, lb.rank
+        FROM referral_stats rs
+        LEFT JOIN referral_leaderboard lb ON lb.referrer_id = rs.referrer_id
+        WHERE rs.referrer_id = %(telegram_id)s
+        """,
+        {"telegram_id": telegram_id},
+    )
+    if not stats:
+        return {"referrals_count": 0, "qualified_referrals": 0, "tokens_earned": 0, "rank": None}
+    return dict(stats)
+
+
+def get_leaderboard(limit: int = 10):
+    limit = max(1, min(limit, REFERRAL_LEADERBOARD_MAX_LIMIT))
+    return fetch_all(
+        """
+        SELECT referrer_id, username, referrals_count, qualified_referrals, tokens_earned, rank
+        FROM referral_leaderboard
+        ORDER BY rank, referrer_id
+        LIMIT %(limit)s
+        """,
+        {"limit": limit},
+    )
+
+
+def mask_username(username) -> str:
+    if not username:
+        return "Anonymous"
+    return f"{username[:3]}***"
+
+
+def get_public_leaderboard(limit: int = 10):
+    """Leaderboard for unauthenticated callers: no Telegram IDs, masked handles only."""
+    return [
+        {
+            "rank": row["rank"],
+            "display_name": mask_username(row["username"]),
+            "referrals_count": row["referrals_count"],
+            "tokens_earned": row["tokens_earned"],
+        }
+        for row in get_leaderboard(limit)
+    ]
+
+
+def refresh_leaderboard() -> bool:
+    """Rebuild the leaderboard unless another process is already doing it."""
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%(key)s)", {"key": LEADERBOARD_REFRESH_LOCK})
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return False
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY referral_leaderboard")
+        conn.commit()
+    return True
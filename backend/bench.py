@@ -0,0 +1,72 @@
+"""Measure backend read throughput against a running stack.
+
+backend/bench_workers.sh runs this at 1, 2, 4 and 8 workers; extra arguments
+(for example --concurrency 64 --duration 60) are passed through.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import requests
+
+ENDPOINTS = [
+    "/api/news",
+    "/api/tasks?telegram_id={telegram_id}",
+    "/api/profile?telegram_id={telegram_id}",
+]
+
+
+def run_client(base_url, deadline, telegram_id, latencies, errors):
+    session = requests.Session()
+    i = 0
+    while time.monotonic() < deadline:
+        path = ENDPOINTS[i % len(ENDPOINTS)].format(telegram_id=telegram_id)
+        i += 1
+        started = time.monotonic()
+        try:
+            response = session.get(base_url + path, timeout=10)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append(time.monotonic() - started)
+        else:
+            errors.append(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--telegram-id-base", type=int, default=900000000)
+    parser.add_argument("--workers-label", default="?")
+    args = parser.parse_args()
+
+    latencies, errors = [], []
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(args.url, deadline, args.telegram_id_base + n, latencies, errors),
+        )
+        for n in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    count = len(latencies)
+    p50 = statistics.median(latencies) * 1000 if count else 0
+    p99 = latencies[int(count * 0.99) - 1] * 1000 if count else 0
+    print(
+        f"workers={args.workers_label} concurrency={args.concurrency} "
+        f"req/s={count / args.duration:.1f} p50={p50:.1f}ms p99={p99:.1f}ms errors={len(errors)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+#!/bin/sh
+# Throughput at 1, 2, 4 and 8 backend workers against the replica stack.
+# Run from the repository root; results are appended to bench_output.txt.
+set -e
+
+COMPOSE="docker compose -f docker-compose.yml -f docker-compose.replica.yml"
+
+for workers in 1 2 4 8; do
+    WEB_CONCURRENCY=$workers $COMPOSE up -d --build --force-recreate backend
+    until curl -sf http://127.0.0.1:8000/health > /dev/null; do
+        sleep 1
+    done
+    python backend/bench.py --workers-label "$workers" "$@" | tee -a bench_output.txt
+done
@@ -0,0 +1,12 @@
+import os
+
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app once in the master and fork workers from it; each worker still
+# opens its own connection pool and cache listener lazily after the fork.
+preload_app = True
+# Restart a worker whose event loop has been blocked this long.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+accesslog = "-"
@@ -0,0 +1,133 @@
+# Read/write routing for the bot. The replica probe and fallback rules mirror
+# backend/app/db.py; keep the two in sync. The bot is a single process, so it
+# connects per query instead of keeping a pool.
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+# libpq rounds anything below 2 up to 2 seconds.
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Set once the current update has written, so its later reads see its own writes.
+_read_from_primary = ContextVar("read_from_primary", default=False)
+
+# dsn -> usable, written only by the replica monitor thread.
+_replica_health = {}
+_monitor_lock = threading.Lock()
+_monitor_started = False
+
+# NULL means unusable: a standby without a streaming WAL receiver has replayed all it
+# received but may be arbitrarily far behind. Roles without pg_read_all_stats see
+# status as NULL, so only an existing receiver is required for them.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE pid IS NOT NULL AND COALESCE(status, 'streaming') = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+@contextmanager
+def get_db(dsn=None):
+    if dsn and dsn != DATABASE_URL:
+        conn = psycopg2.connect(dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+    else:
+        conn = psycopg2.connect(DATABASE_URL)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def reset_read_routing():
+    _read_from_primary.set(False)
+
+
+def stick_to_primary():
+    _read_from_primary.set(True)
+
+
+def probe_replica(dsn: str) -> bool:
+    try:
+        with get_db(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(REPLICA_LAG_QUERY)
+                lag = cur.fetchone()[0]
+    except psycopg2.Error:
+        return False
+    return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+
+
+def monitor_replicas():
+    while True:
+        for dsn in DATABASE_REPLICA_URLS:
+            _replica_health[dsn] = probe_replica(dsn)
+        time.sleep(REPLICA_LAG_CHECK_SECONDS)
+
+
+def ensure_replica_monitor():
+    """Start the probe thread once, so reads never wait on a probe."""
+    global _monitor_started
+    if _monitor_started:
+        return
+    with _monitor_lock:
+        if not _monitor_started:
+            threading.Thread(target=monitor_replicas, name="replica-monitor", daemon=True).start()
+            _monitor_started = True
+
+
+def read_dsn() -> str:
+    """Pick the DSN for a read: a healthy replica, or the primary when none qualifies."""
+    if _read_from_primary.get() or not DATABASE_REPLICA_URLS:
+        return DATABASE_URL
+    ensure_replica_monitor()
+    replicas = [dsn for dsn in DATABASE_REPLICA_URLS if _replica_health.get(dsn, False)]
+    return random.choice(replicas) if replicas else DATABASE_URL
+
+
+def _fetch(query, params, fetch, primary):
+    dsn = DATABASE_URL if primary else read_dsn()
+    try:
+        with get_db(dsn) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, params or {})
+                return fetch(cur)
+    except psycopg2.OperationalError:
+        if dsn == DATABASE_URL:
+            raise
+        _replica_health[dsn] = False
+    with get_db() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params or {})
+            return fetch(cur)
+
+
+def fetch_one(query, params=None, primary=False):
+    return _fetch(query, params, lambda cur: cur.fetchone(), primary)
+
+
+def fetch_all(query, params=None, primary=False):
+    return _fetch(query, params, lambda cur: cur.fetchall(), primary)
+
+
+def execute(query, params=None):
+    stick_to_primary()
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params or {})
+        conn.commit()
@@ -1,49 +1,59 @@
 import os
 
-import psycopg2
 import requests
-from psycopg2.extras import RealDictCursor
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, WebAppInfo
-from telegram.ext import ApplicationBuilder, CallbackQueryHandler, ChatJoinRequestHandler, CommandHandler, ContextTypes
+from telegram.ext import (
+    ApplicationBuilder,
+    CallbackQueryHandler,
+    ChatJoinRequestHandler,
+    CommandHandler,
+    ContextTypes,
+    TypeHandler,
+)
+
+from db import execute, fetch_all, fetch_one, reset_read_routing
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_USERNAME = os.getenv("BOT_USERNAME")
-DATABASE_URL = os.getenv("DATABASE_URL")
 WEBAPP_URL = os.getenv("WEBAPP_URL")
 
-
-def get_db():
-    return psycopg2.connect(DATABASE_URL)
-
-
-def fetch_all(query, params=None):
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params or {})
-            return cur.fetchall()
-
-
-def fetch_one(query, params=None):
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params or {})
-            return cur.fetchone()
-
-
-def execute(query, params=None):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute(query, params or {})
-        conn.commit()
+SIGNUP_REFERRAL_BONUS = 1000
 
 
 def ensure_user(user, referred_by=None):
-    existing = fetch_one("SELECT * FROM users WHERE telegram_id = %(telegram_id)s", {"telegram_id": user.id})
+    if referred_by == user.id:
+        referred_by = None
+    # Read from the primary: a lagging replica would grant the referral bonus twice.
+    existing = fetch_one(
+        "SELECT * FROM users WHERE telegram_id = %(telegram_id)s", {"telegram_id": user.id}, primary=True
+    )
     if not existing:
+        # One statement, so the signup, the referrer's bonus, its ledger row and the
+        # referral counters commit together, and only if this call created the user.
         execute(
             """
-            INSERT INTO users (telegram_id, username, first_name, last_name, referred_by)
-            VALUES (%(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(referred_by)s)
+            WITH new_user AS (
+                INSERT INTO users (telegram_id, username, first_name, last_name, referred_by)
+                VALUES (%(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(referred_by)s)
+                ON CONFLICT (telegram_id) DO NOTHING
+                RETURNING referred_by
+            ),
+            referral AS (
+                SELECT referred_by AS referrer FROM new_user WHERE referred_by IS NOT NULL
+            ),
+            bonus AS (
+                UPDATE users SET tokens = tokens + %(bonus)s WHERE telegram_id IN (SELECT referrer FROM referral)
+            ),
+            ledger AS (
+                INSERT INTO token_history (user_id, change_amount, reason)
+                SELECT referrer, %(bonus)s, %(reason)s FROM referral
+            )
+            INSERT INTO referral_stats (referrer_id, referrals_count, tokens_earned, updated_at)
+            SELECT referrer, 1, %(bonus)s, NOW() FROM referral
+            ON CONFLICT (referrer_id)
+            DO UPDATE SET referrals_count = referral_stats.referrals_count + 1,
+                          tokens_earned = referral_stats.tokens_earned + EXCLUDED.tokens_earned,
+                          updated_at = NOW()
             """,
             {
                 "telegram_id": user.id,
@@ -51,22 +61,10 @@ def ensure_user(user, referred_by=None):
                 "first_name": user.first_name,
                 "last_name": user.last_name,
                 "referred_by": referred_by,
+                "bonus": SIGNUP_REFERRAL_BONUS,
+                "reason": f"Referral bonus for {user.id}",
             },
         )
-        if referred_by:
-            execute(
-                """
-                UPDATE users SET tokens = tokens + 1000 WHERE telegram_id = %(referrer)s
-                """,
-                {"referrer": referred_by},
-            )
-            execute(
-                """
-                INSERT INTO token_history (user_id, change_amount, reason)
-                VALUES (%(referrer)s, 1000, %(reason)s)
-                """,
-                {"referrer": referred_by, "reason": f"Referral bonus for {user.id}"},
-            )
 
 
 def get_mandatory_channels():
@@ -139,8 +137,13 @@ async def approve_join_request(update: Update, context: ContextTypes.DEFAULT_TYP
         await join_request.approve()
 
 
+async def route_reads_per_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reset_read_routing()
+
+
 def main():
     application = ApplicationBuilder().token(BOT_TOKEN).build()
+    application.add_handler(TypeHandler(Update, route_reads_per_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(next_step, pattern="^next$"))
     application.add_handler(ChatJoinRequestHandler(approve_join_request))
@@ -65,3 +65,34 @@ VALUES
   ('token_rate', '1000=0.1'),
   ('support_link', 'https://t.me/support')
 ON CONFLICT (key) DO NOTHING;
+
+-- Existing databases get these, plus a backfill, from backend/app/migrations/referrals.sql.
+CREATE TABLE IF NOT EXISTS referral_stats (
+    referrer_id BIGINT PRIMARY KEY,
+    referrals_count BIGINT NOT NULL DEFAULT 0,
+    qualified_referrals BIGINT NOT NULL DEFAULT 0,
+    tokens_earned BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS referral_qualifications (
+    referrer_id BIGINT NOT NULL,
+    referred_id BIGINT NOT NULL,
+    qualified_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (referrer_id, referred_id)
+);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS referral_leaderboard AS
+SELECT
+    rs.referrer_id,
+    u.username,
+    rs.referrals_count,
+    rs.qualified_referrals,
+    rs.tokens_earned,
+    RANK() OVER (ORDER BY rs.tokens_earned DESC, rs.referrals_count DESC) AS rank
+FROM referral_stats rs
+LEFT JOIN users u ON u.telegram_id = rs.referrer_id
+WHERE rs.referrals_count > 0 OR rs.tokens_earned > 0;
+
+CREATE UNIQUE INDEX IF NOT EXISTS referral_leaderboard_referrer_idx ON referral_leaderboard (referrer_id);
+CREATE INDEX IF NOT EXISTS referral_leaderboard_rank_idx ON referral_leaderboard (rank);
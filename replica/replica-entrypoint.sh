@@ -0,0 +1,13 @@
+#!/bin/sh
+# Clones the primary with pg_basebackup on first start, then runs as a hot standby.
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_isready -h db -U "$POSTGRES_USER"; do
+        sleep 1
+    done
+    PGPASSWORD="$REPLICATION_PASSWORD" pg_basebackup -h db -U replicator -D "$PGDATA" -R -X stream
+    chmod 700 "$PGDATA"
+fi
+
+exec postgres
@@ -12,6 +12,7 @@ const channelLinks = document.getElementById("channel-links");
 const tasksContainer = document.getElementById("tasks");
 const profileInfo = document.getElementById("profile-info");
 const newsList = document.getElementById("news-list");
+const leaderboardList = document.getElementById("leaderboard");
 const supportButton = document.getElementById("support-button");
 
 function show(element) {
@@ -94,10 +95,28 @@ async function loadProfile() {
     <p>Referral link: <a href="${data.referral_link}" target="_blank">${data.referral_link}</a></p>
     <p>Tokens: ${data.tokens}</p>
     <p>Token rate: ${data.token_rate}</p>
+    <p>Referrals: ${data.referrals.referrals_count} (qualified: ${data.referrals.qualified_referrals})</p>
+    <p>Referral tokens earned: ${data.referrals.tokens_earned}</p>
+    <p>Referral rank: ${data.referrals.rank || "-"}</p>
   `;
   supportButton.onclick = () => window.open(data.support_link, "_blank");
 }
 
+async function loadLeaderboard() {
+  const response = await fetch("/api/referrals/leaderboard?limit=10");
+  const data = await response.json();
+  leaderboardList.innerHTML = "";
+  data.leaderboard.forEach((row) => {
+    const card = document.createElement("div");
+    card.className = "card";
+    card.innerHTML = `
+      <p>#${row.rank} ${row.display_name}</p>
+      <p>Referrals: ${row.referrals_count} | Tokens: ${row.tokens_earned}</p>
+    `;
+    leaderboardList.appendChild(card);
+  });
+}
+
 async function loadNews() {
   const response = await fetch("/api/news");
   const data = await response.json();
@@ -130,7 +149,7 @@ async function init() {
   }
   hide(subscriptionBlock);
   show(appEl);
-  await Promise.all([loadTasks(), loadProfile(), loadNews()]);
+  await Promise.all([loadTasks(), loadProfile(), loadLeaderboard(), loadNews()]);
 }
 
 document.querySelectorAll(".bottom-nav button").forEach((button) => {